@@ -0,0 +1,196 @@
+# In-memory view of the futures account: wallet balances per asset and
+# position amounts per symbol, seeded over REST and kept current from
+# ACCOUNT_UPDATE events on the user data stream.
+
+import pprint
+import threading
+import time
+
+import recorder
+import util
+
+from binance.exceptions import BinanceAPIException
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def get_snapshot(api_key, api_secret):
+    """
+    Return the process wide snapshot for the given key, creating, seeding and
+    starting its user data stream on first use.
+    """
+    with _snapshots_lock:
+        snapshot = _snapshots.get(api_key)
+        if snapshot is None:
+            snapshot = AccountSnapshot(api_key, api_secret)
+            snapshot.sync()
+            snapshot.start_stream()
+            _snapshots[api_key] = snapshot
+        return snapshot
+
+
+class AccountSnapshot:
+
+    # Resync over REST if nothing was heard for this long while streaming
+    MAX_AGE = 60.0
+    # Resync over REST if older than this while the stream is down
+    POLL_AGE = 1.0
+
+    def __init__(self, api_key, api_secret, max_age=MAX_AGE, poll_age=POLL_AGE):
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.client = recorder.make_client(api_key, api_secret)
+        self.log = util.getLogger("account")
+        self.max_age = max_age
+        self.poll_age = poll_age
+
+        self.balances = {}
+        # {symbol: {positionSide: positionAmt}}
+        self.positions = {}
+        # Time each asset / symbol was last set, so an older REST result
+        # never overwrites a newer event
+        self.balance_times = {}
+        self.position_times = {}
+        self.last_update = 0.0
+        self.last_sync = 0.0
+        self.streaming = False
+        self.twm = None
+        self.listeners = []
+        self.lock = threading.RLock()
+        # Serializes REST resyncs between threads
+        self.sync_lock = threading.Lock()
+
+    def sync(self):
+        """Reload balances and positions over REST."""
+        self.log.info("Sync account snapshot")
+        # The data is as old as the request, not the response
+        t = time.time()
+        try:
+            balances = self.client.futures_account_balance()
+            positions = self.client.futures_position_information()
+        except BinanceAPIException as e:
+            self.log.exception("BinanceAPIException: %s", e)
+            return False
+        except Exception as e:
+            self.log.exception("Unexpected Error: %s", e)
+            return False
+
+        newBalances = {}
+        for b in balances:
+            newBalances[b["asset"]] = float(b["balance"])
+
+        newPositions = {}
+        for p in positions:
+            side = p.get("positionSide", "BOTH")
+            newPositions.setdefault(p["symbol"], {})[side] = float(p["positionAmt"])
+
+        with self.lock:
+            for asset, updated in self.balance_times.items():
+                if updated >= t and asset in self.balances:
+                    newBalances[asset] = self.balances[asset]
+            for symbol, updated in self.position_times.items():
+                if updated >= t and symbol in self.positions:
+                    newPositions[symbol] = self.positions[symbol]
+            self.balance_times = {a: max(t, self.balance_times.get(a, 0.0)) for a in newBalances}
+            self.position_times = {s: max(t, self.position_times.get(s, 0.0)) for s in newPositions}
+            self.balances = newBalances
+            self.positions = newPositions
+            self.last_sync = max(self.last_sync, t)
+            self.last_update = max(self.last_update, t)
+
+        return True
+
+    def start_stream(self):
+        """Subscribe to the futures user data stream."""
+        try:
+            self.twm = recorder.start_user_socket(self.api_key, self.api_secret,
+                                                  self.handle_event)
+            self.streaming = True
+        except Exception as e:
+            self.log.exception("Could not start user data stream: %s", e)
+            self.twm = None
+            self.streaming = False
+
+        return self.streaming
+
+    def stop_stream(self):
+        if self.twm:
+            self.twm.stop()
+        self.twm = None
+        self.streaming = False
+
+    def add_listener(self, callback):
+        """Call callback(event) for every user data stream event."""
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def handle_event(self, event):
+        eventType = event.get("e")
+        if eventType in ("error", "listenKeyExpired"):
+            self.log.warning("User data stream down: %s", pprint.pformat(event))
+            self.streaming = False
+        else:
+            if not self.streaming:
+                # The websocket manager reconnected on its own
+                self.log.info("User data stream back up")
+                self.streaming = True
+            if eventType == "ACCOUNT_UPDATE":
+                self.apply_account_update(event)
+            else:
+                with self.lock:
+                    self.last_update = time.time()
+
+        for callback in list(self.listeners):
+            try:
+                callback(event)
+            except Exception as e:
+                self.log.exception("Listener error: %s", e)
+
+    def apply_account_update(self, event):
+        self.log.debug("ACCOUNT_UPDATE: %s", pprint.pformat(event))
+        update = event["a"]
+        t = time.time()
+        with self.lock:
+            for b in update.get("B", []):
+                self.balances[b["a"]] = float(b["wb"])
+                self.balance_times[b["a"]] = t
+            for p in update.get("P", []):
+                side = p.get("ps", "BOTH")
+                self.positions.setdefault(p["s"], {})[side] = float(p["pa"])
+                self.position_times[p["s"]] = t
+            self.last_update = t
+
+    def is_stale(self):
+        age = time.time() - self.last_update
+        if self.streaming:
+            return age > self.max_age
+        return age > self.poll_age
+
+    def refresh(self, force=False):
+        if not force and not self.is_stale():
+            return
+
+        requested = time.time()
+        with self.sync_lock:
+            # Another thread resynced, from data fetched after this request,
+            # while this one was waiting
+            if self.last_sync > requested:
+                return
+            if not force and not self.is_stale():
+                return
+            self.sync()
+
+    def get_balance(self, asset="USDT", refresh=False):
+        self.refresh(force=refresh)
+        with self.lock:
+            return self.balances.get(asset, 0.0)
+
+    def get_position_amt(self, symbol, refresh=False):
+        """Signed position amount for symbol, summed over position sides."""
+        self.refresh(force=refresh)
+        with self.lock:
+            return sum(self.positions.get(symbol, {}).values())
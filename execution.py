@@ -0,0 +1,463 @@
+# Entry execution.  Each mode works an entry order until it is filled or its
+# timeout runs out and returns an aggregated order dict in the shape the TP/SL
+# routines expect.  Fill latency and slippage are recorded per mode.
+#
+# Order state comes from ORDER_TRADE_UPDATE events when an account snapshot
+# with a live user data stream is given, with futures_get_order only as a slow
+# fallback for missed events.  Without the stream orders are polled over REST.
+#
+#   limit        - GTC limit at the alert price, cancelled at the timeout
+#   chase        - post-only (GTX) limit at the passive best price, re-priced
+#                  from bookTicker whenever the book moves
+#   limit_market - limit as above, the rest sent at market if the book is
+#                  still within MAX_SLIPPAGE of the alert price
+#   sliced       - child orders, each worked as limit_market from the
+#                  passive best price; one order if the quantity is too small
+#                  to split into MIN_SLICE_NOTIONAL children
+
+import pprint
+import threading
+import time
+
+import util
+
+from binance.exceptions import BinanceAPIException
+
+DEFAULT_MODE = "limit"
+TERMINAL = ("FILLED", "CANCELED", "EXPIRED", "REJECTED")
+
+
+class ExecutionStats:
+    """Running fill latency, slippage and fill ratio per execution mode."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.modes = {}
+
+    def record(self, mode, latency, slippage_bps, fill_ratio):
+        """Record one entry; slippage_bps is None if nothing filled."""
+        with self.lock:
+            s = self.modes.setdefault(mode, {"count": 0, "filled": 0, "latency": 0.0,
+                                             "max_latency": 0.0, "slippage_bps": 0.0,
+                                             "fill_ratio": 0.0})
+            s["count"] += 1
+            s["fill_ratio"] += fill_ratio
+            if slippage_bps is not None:
+                s["filled"] += 1
+                s["latency"] += latency
+                s["max_latency"] = max(s["max_latency"], latency)
+                s["slippage_bps"] += slippage_bps
+
+    def summary(self):
+        """Return per mode counts, fill latency, slippage (bps) and fill ratio."""
+        summary = {}
+        with self.lock:
+            for mode, s in self.modes.items():
+                filled = max(s["filled"], 1)
+                summary[mode] = {
+                    "count": s["count"],
+                    "missed": s["count"] - s["filled"],
+                    "avg_latency": s["latency"] / filled,
+                    "max_latency": s["max_latency"],
+                    "avg_slippage_bps": s["slippage_bps"] / filled,
+                    "avg_fill_ratio": s["fill_ratio"] / s["count"],
+                }
+        return summary
+
+
+stats = ExecutionStats()
+
+
+class Fills:
+    """Accumulates the final state of every child order of one entry."""
+
+    def __init__(self):
+        self.qty = 0.0
+        self.notional = 0.0
+        self.orderIds = []
+        # Orders whose final state could not be confirmed
+        self.unresolved = []
+        self.last_fill = None
+
+    def add(self, order):
+        """Add an order in a terminal state."""
+        if not order:
+            return
+        if order["orderId"] not in self.orderIds:
+            self.orderIds.append(order["orderId"])
+        qty = float(order.get("executedQty", 0.0))
+        if qty > 0.0:
+            self.qty += qty
+            self.notional += qty * float(order["avgPrice"])
+            self.last_fill = time.time()
+
+    @property
+    def avgPrice(self):
+        return self.notional / self.qty if self.qty else 0.0
+
+
+class EntryExecutor:
+
+    MODES = ("limit", "chase", "limit_market", "sliced")
+
+    # Working time per mode, in seconds
+    TIMEOUTS = {
+        "limit": 30.0,
+        "chase": 30.0,
+        "limit_market": 10.0,
+        "sliced": 30.0,
+    }
+    # Order status polling interval over REST, without the user data stream
+    POLL = 1.0
+    # Check interval for order events while streaming
+    EVENT_POLL = 0.1
+    # REST check of an order while streaming, in case an event was missed
+    FALLBACK_POLL = 2.0
+    # Chase re-reads the book at most this often
+    REPRICE = 1.0
+    # Chase never prices worse than this fraction from the alert price
+    MAX_CHASE = 0.002
+    # No market order if the book is further than this from the alert price
+    MAX_SLIPPAGE = 0.002
+    # Default number of child orders for sliced mode
+    SLICES = 3
+    # Smallest child order sliced mode sends, in quote asset
+    MIN_SLICE_NOTIONAL = 100.0
+
+    def __init__(self, client, price_precision, quantity_precision, account=None):
+        self.client = client
+        self.account = account
+        self.log = util.getLogger("execution")
+        self.price_precision = price_precision
+        self.quantity_precision = quantity_precision
+        self.tick = 10 ** -price_precision
+        self.step = 10 ** -quantity_precision
+
+        self.lock = threading.Lock()
+        # Latest state per orderId from ORDER_TRADE_UPDATE events
+        self.updates = {}
+        # Time of the last REST read (or place / cancel) per orderId
+        self.polled = {}
+
+    def execute(self, symbol, side, quantity, price, mode=DEFAULT_MODE,
+                timeout=None, slices=SLICES):
+        if mode not in EntryExecutor.MODES:
+            self.log.warning("Unknown execution mode %s, using %s", mode, DEFAULT_MODE)
+            mode = DEFAULT_MODE
+        if timeout is None:
+            timeout = EntryExecutor.TIMEOUTS[mode]
+
+        quantity = self.round_qty(quantity)
+        self.log.info("Execute %s %s %s: quantity=%s, price=%s, timeout=%s",
+                      mode, side, symbol, quantity, price, timeout)
+
+        if self.account is not None:
+            self.account.add_listener(self.handle_event)
+
+        fills = Fills()
+        t0 = time.time()
+        try:
+            if mode == "limit":
+                self.limit(fills, symbol, side, quantity, price, timeout)
+            elif mode == "chase":
+                self.chase(fills, symbol, side, quantity, price, timeout)
+            elif mode == "limit_market":
+                self.limit_market(fills, symbol, side, quantity, price, price, timeout)
+            else:
+                self.sliced(fills, symbol, side, quantity, price, timeout, slices)
+        finally:
+            if self.account is not None:
+                self.account.remove_listener(self.handle_event)
+
+        return self.result(fills, mode, symbol, side, quantity, price, t0)
+
+    # Modes
+
+    def chase(self, fills, symbol, side, quantity, price, timeout):
+        t0 = time.time()
+        if side == "BUY":
+            limit = price * (1.0 + EntryExecutor.MAX_CHASE)
+        else:
+            limit = price * (1.0 - EntryExecutor.MAX_CHASE)
+
+        order = None
+        orderPrice = None
+        lastBook = 0.0
+        while time.time() - t0 < timeout:
+            if order is not None:
+                o = self.order_state(symbol, order["orderId"])
+                if o is not None and o["status"] in TERMINAL:
+                    fills.add(o)
+                    order = None
+                    continue
+
+            remaining = self.round_qty(quantity - fills.qty)
+            if remaining <= 0.0:
+                return
+
+            if time.time() - lastBook >= EntryExecutor.REPRICE:
+                lastBook = time.time()
+                target = self.passive_price(symbol, side)
+                if target is not None:
+                    target = min(target, limit) if side == "BUY" else max(target, limit)
+                    if order is not None and abs(target - orderPrice) >= self.tick / 2:
+                        self.log.debug("Re-price %s %s -> %s", symbol, orderPrice, target)
+                        orderId = order["orderId"]
+                        order = None
+                        if not self.settle(fills, symbol, orderId):
+                            return
+                        remaining = self.round_qty(quantity - fills.qty)
+                    if order is None and remaining > 0.0:
+                        order = self.place(symbol, side, remaining, "LIMIT", target, "GTX")
+                        orderPrice = target
+                        if order is not None and order["status"] == "EXPIRED":
+                            # Would have crossed the book, re-price
+                            fills.add(order)
+                            order = None
+
+            self.wait()
+
+        if order is not None:
+            self.settle(fills, symbol, order["orderId"])
+
+    def limit(self, fills, symbol, side, quantity, price, timeout):
+        """
+        Work a GTC limit until filled or timeout.  Return True if the order
+        was placed and its final state is known.
+        """
+        t0 = time.time()
+        order = self.place(symbol, side, quantity, "LIMIT", price, "GTC")
+        if order is None:
+            return False
+
+        while time.time() - t0 < timeout:
+            o = self.order_state(symbol, order["orderId"])
+            if o is not None and o["status"] in TERMINAL:
+                fills.add(o)
+                return True
+            self.wait()
+
+        return self.settle(fills, symbol, order["orderId"])
+
+    def limit_market(self, fills, symbol, side, quantity, price, ref_price, timeout):
+        # fills may already hold earlier slices
+        filled = fills.qty
+        if not self.limit(fills, symbol, side, quantity, price, timeout):
+            return False
+
+        remaining = self.round_qty(quantity - (fills.qty - filled))
+        if remaining <= 0.0:
+            return True
+
+        book = self.book(symbol)
+        if book is None:
+            return False
+        bid, ask = book
+        if side == "BUY":
+            bound = ref_price * (1.0 + EntryExecutor.MAX_SLIPPAGE)
+            allowed = ask <= bound
+        else:
+            bound = ref_price * (1.0 - EntryExecutor.MAX_SLIPPAGE)
+            allowed = bid >= bound
+        if not allowed:
+            self.log.warning("Book for %s moved past %s (bid=%s, ask=%s), no market order",
+                             symbol, bound, bid, ask)
+            return False
+
+        self.log.info("Limit timeout for %s, sending %s at market", symbol, remaining)
+        order = self.place(symbol, side, remaining, "MARKET")
+        if order is None:
+            return False
+        o = self.wait_filled(symbol, order["orderId"])
+        if o is None:
+            fills.unresolved.append(order["orderId"])
+            return False
+        fills.add(o)
+        return True
+
+    def sliced(self, fills, symbol, side, quantity, ref_price, timeout, slices):
+        # Every child must be at least one step and MIN_SLICE_NOTIONAL
+        slices = min(slices, int(quantity * ref_price / EntryExecutor.MIN_SLICE_NOTIONAL),
+                     int(round(quantity / self.step)))
+        if slices <= 1:
+            price = self.passive_price(symbol, side) or ref_price
+            self.log.info("Order for %s too small to slice, quantity=%s, price=%s",
+                          symbol, quantity, price)
+            self.limit_market(fills, symbol, side, quantity, price, ref_price, timeout)
+            return
+
+        child = self.round_qty(quantity / slices)
+        for number in range(slices):
+            remaining = self.round_qty(quantity - fills.qty)
+            if remaining <= 0.0:
+                return
+            childQty = remaining if number == slices - 1 else min(child, remaining)
+            price = self.passive_price(symbol, side)
+            if price is None:
+                continue
+            self.log.info("Slice %s/%s for %s: quantity=%s, price=%s",
+                          number + 1, slices, symbol, childQty, price)
+            if not self.limit_market(fills, symbol, side, childQty, price, ref_price,
+                                     timeout / slices):
+                return
+
+    # Order events
+
+    def handle_event(self, event):
+        """AccountSnapshot listener, keeps the latest state of each order."""
+        if event.get("e") != "ORDER_TRADE_UPDATE":
+            return
+        o = event["o"]
+        with self.lock:
+            self.updates[o["i"]] = {"orderId": o["i"], "symbol": o["s"], "side": o["S"],
+                                    "status": o["X"], "executedQty": o["z"],
+                                    "avgPrice": o["ap"]}
+
+    def streaming(self):
+        return self.account is not None and self.account.streaming
+
+    def wait(self):
+        if self.streaming():
+            time.sleep(EntryExecutor.EVENT_POLL)
+        else:
+            time.sleep(EntryExecutor.POLL)
+
+    def order_state(self, symbol, orderId):
+        """
+        Latest known state of orderId, from events while streaming and over
+        REST otherwise or when no event arrived for FALLBACK_POLL.
+        """
+        with self.lock:
+            order = self.updates.get(orderId)
+        if order is not None and order["status"] in TERMINAL:
+            return order
+
+        if self.streaming():
+            now = time.time()
+            if now - self.polled.get(orderId, 0.0) < EntryExecutor.FALLBACK_POLL:
+                return order
+        return self.get_order(symbol, orderId) or order
+
+    # Exchange helpers
+
+    def round_qty(self, quantity):
+        return float("{0:.{1}f}".format(max(quantity, 0.0), self.quantity_precision))
+
+    def book(self, symbol):
+        """Return (best bid, best ask) or None."""
+        try:
+            ticker = self.client.futures_orderbook_ticker(symbol=symbol)
+        except BinanceAPIException as e:
+            self.log.exception("BinanceAPIException: %s", e)
+            return None
+        except Exception as e:
+            self.log.exception("Unexpected Error: %s", e)
+            return None
+
+        return float(ticker["bidPrice"]), float(ticker["askPrice"])
+
+    def passive_price(self, symbol, side):
+        """Best bid for a buy, best ask for a sell."""
+        book = self.book(symbol)
+        if book is None:
+            return None
+        return book[0] if side == "BUY" else book[1]
+
+    def place(self, symbol, side, quantity, orderType, price=None, timeInForce=None):
+        params = {"symbol": symbol, "side": side, "type": orderType,
+                  "quantity": quantity, "newOrderRespType": "RESULT"}
+        if orderType == "LIMIT":
+            params["price"] = "{0:.{1}f}".format(price, self.price_precision)
+            params["timeInForce"] = timeInForce
+
+        try:
+            order = self.client.futures_create_order(**params)
+            self.log.debug("futures_create_order: %s", pprint.pformat(order))
+            self.polled[order["orderId"]] = time.time()
+            return order
+        except BinanceAPIException as e:
+            # Post-only orders that would cross are rejected
+            self.log.warning("Order rejected %s: %s", pprint.pformat(params), e)
+        except Exception as e:
+            self.log.exception("Unexpected Error: %s", e)
+        return None
+
+    def get_order(self, symbol, orderId):
+        self.polled[orderId] = time.time()
+        try:
+            return self.client.futures_get_order(symbol=symbol, orderId=orderId)
+        except BinanceAPIException as e:
+            self.log.exception("BinanceAPIException: %s", e)
+        except Exception as e:
+            self.log.exception("Unexpected Error: %s", e)
+        return None
+
+    def settle(self, fills, symbol, orderId):
+        """
+        Cancel orderId and add its final state to fills.  Return False if the
+        final state could not be confirmed.
+        """
+        try:
+            self.client.futures_cancel_order(symbol=symbol, orderId=orderId)
+        except BinanceAPIException as e:
+            # Already filled or cancelled
+            self.log.debug("Cancel %s %s: %s", symbol, orderId, e)
+        except Exception as e:
+            self.log.exception("Unexpected Error: %s", e)
+        # Give the cancel event a chance before asking over REST
+        self.polled[orderId] = time.time()
+
+        order = self.wait_filled(symbol, orderId)
+        if order is None:
+            self.log.warning("Could not confirm final state of %s order %s", symbol, orderId)
+            fills.unresolved.append(orderId)
+            return False
+        fills.add(order)
+        return True
+
+    def wait_filled(self, symbol, orderId, status=TERMINAL, timeout=5.0):
+        """Return the order once it reaches one of status, None on timeout."""
+        t0 = time.time()
+        while time.time() - t0 < timeout:
+            order = self.order_state(symbol, orderId)
+            if order is not None and order["status"] in status:
+                return order
+            self.wait()
+        return None
+
+    def result(self, fills, mode, symbol, side, quantity, price, t0):
+        fill_ratio = fills.qty / quantity if quantity else 0.0
+        if fills.qty <= 0.0:
+            status = "CANCELED"
+        elif fill_ratio < 1.0:
+            status = "PARTIALLY_FILLED"
+        else:
+            status = "FILLED"
+
+        latency = (fills.last_fill or time.time()) - t0
+        slippage_bps = None
+        if fills.qty > 0.0 and price:
+            # Positive is worse than the alert price
+            slippage_bps = (fills.avgPrice - price) / price * 10000.0
+            if side == "SELL":
+                slippage_bps = -slippage_bps
+        stats.record(mode, latency, slippage_bps, fill_ratio)
+
+        self.log.info("Execution %s %s %s: status=%s, filled=%s/%s, avgPrice=%s, "
+                      "latency=%.2fs, slippage=%sbps, orders=%s, unresolved=%s",
+                      mode, side, symbol, status, fills.qty, quantity, fills.avgPrice,
+                      latency, slippage_bps, len(fills.orderIds), fills.unresolved)
+        self.log.debug("Execution stats: %s", pprint.pformat(stats.summary()))
+
+        return {
+            "symbol": symbol,
+            "side": side,
+            "status": status,
+            "executedQty": self.round_qty(fills.qty),
+            "avgPrice": fills.avgPrice,
+            "orderIds": fills.orderIds + fills.unresolved,
+            "unresolved": fills.unresolved,
+            "mode": mode,
+            "latency": latency,
+            "slippage_bps": slippage_bps,
+        }
@@ -0,0 +1,353 @@
+# Realized PnL ledger.  Account trades and income history are pulled in pages
+# from a cursor persisted in sqlite, fills are attributed to bot trades by
+# order ID and per-trade realized PnL, fees and funding kept as running totals.
+
+import pprint
+import sqlite3
+import threading
+import time
+
+import recorder
+import util
+
+from binance.exceptions import BinanceAPIException
+
+LEDGER_DB = "ledger.db"
+
+_ledgers = {}
+_ledgers_lock = threading.Lock()
+
+
+def get_ledger(api_key, api_secret, path=None):
+    """Return the process wide ledger for the given key and database."""
+    if path is None:
+        path = LEDGER_DB
+    with _ledgers_lock:
+        ledger = _ledgers.get((api_key, path))
+        if ledger is None:
+            ledger = TradeLedger(api_key, api_secret, path)
+            _ledgers[(api_key, path)] = ledger
+        return ledger
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class TradeLedger:
+
+    # Page size for account trades and income history
+    PAGE_LIMIT = 1000
+    # Fees are only totalled in the margin asset
+    ASSET = "USDT"
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS trades (
+            trade_id TEXT PRIMARY KEY,
+            symbol TEXT NOT NULL,
+            side TEXT,
+            strategy TEXT,
+            opened_at INTEGER NOT NULL,
+            closed_at INTEGER,
+            realized_pnl REAL NOT NULL DEFAULT 0,
+            fees REAL NOT NULL DEFAULT 0,
+            funding REAL NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS trades_symbol ON trades (symbol, opened_at);
+        CREATE INDEX IF NOT EXISTS trades_closed ON trades (closed_at);
+        CREATE TABLE IF NOT EXISTS orders (
+            symbol TEXT NOT NULL,
+            order_id INTEGER NOT NULL,
+            trade_id TEXT NOT NULL,
+            PRIMARY KEY (symbol, order_id)
+        );
+        CREATE TABLE IF NOT EXISTS fills (
+            symbol TEXT NOT NULL,
+            id INTEGER NOT NULL,
+            order_id INTEGER NOT NULL,
+            trade_id TEXT,
+            side TEXT,
+            price REAL,
+            qty REAL,
+            realized_pnl REAL,
+            commission REAL,
+            commission_asset TEXT,
+            time INTEGER,
+            PRIMARY KEY (symbol, id)
+        );
+        CREATE INDEX IF NOT EXISTS fills_order ON fills (symbol, order_id);
+        CREATE TABLE IF NOT EXISTS income (
+            tran_id INTEGER NOT NULL,
+            income_type TEXT NOT NULL,
+            asset TEXT NOT NULL,
+            symbol TEXT,
+            income REAL,
+            time INTEGER,
+            trade_id TEXT,
+            PRIMARY KEY (tran_id, income_type, asset)
+        );
+        CREATE TABLE IF NOT EXISTS cursors (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+    """
+
+    def __init__(self, api_key, api_secret, path=LEDGER_DB):
+        self.client = recorder.make_client(api_key, api_secret)
+        self.log = util.getLogger("ledger")
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        with self.db:
+            self.db.executescript(TradeLedger.SCHEMA)
+
+    # Trade and order registration
+
+    def open_trade(self, trade_id, symbol, side=None, strategy=None, opened_at=None):
+        if opened_at is None:
+            opened_at = now_ms()
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO trades (trade_id, symbol, side, strategy, opened_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (trade_id, symbol, side, strategy, opened_at))
+
+    def close_trade(self, trade_id, closed_at=None):
+        if closed_at is None:
+            closed_at = now_ms()
+        with self.lock, self.db:
+            self.db.execute("UPDATE trades SET closed_at = ? WHERE trade_id = ?",
+                            (closed_at, trade_id))
+
+    def add_order(self, trade_id, symbol, order):
+        """Attribute order (an order dict or order ID) to trade_id."""
+        if not order:
+            return
+        orderId = int(order["orderId"] if isinstance(order, dict) else order)
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO orders (symbol, order_id, trade_id) VALUES (?, ?, ?)",
+                (symbol, orderId, trade_id))
+
+            # Fills synced before the order was registered
+            row = self.db.execute(
+                "SELECT COUNT(*) AS n, COALESCE(SUM(realized_pnl), 0) AS pnl, "
+                "COALESCE(SUM(CASE WHEN commission_asset = ? THEN commission ELSE 0 END), 0) AS fees "
+                "FROM fills WHERE symbol = ? AND order_id = ? AND trade_id IS NULL",
+                (TradeLedger.ASSET, symbol, orderId)).fetchone()
+            if row["n"]:
+                self.db.execute(
+                    "UPDATE fills SET trade_id = ? "
+                    "WHERE symbol = ? AND order_id = ? AND trade_id IS NULL",
+                    (trade_id, symbol, orderId))
+                self.db.execute(
+                    "UPDATE trades SET realized_pnl = realized_pnl + ?, fees = fees + ? "
+                    "WHERE trade_id = ?",
+                    (row["pnl"], row["fees"], trade_id))
+
+    # Incremental sync
+
+    def get_cursor(self, name):
+        row = self.db.execute("SELECT value FROM cursors WHERE name = ?",
+                              (name,)).fetchone()
+        return row["value"] if row else None
+
+    def set_cursor(self, name, value):
+        self.db.execute("INSERT OR REPLACE INTO cursors (name, value) VALUES (?, ?)",
+                        (name, value))
+
+    def first_opened_at(self, symbol=None):
+        if symbol:
+            row = self.db.execute("SELECT MIN(opened_at) AS t FROM trades WHERE symbol = ?",
+                                  (symbol,)).fetchone()
+        else:
+            row = self.db.execute("SELECT MIN(opened_at) AS t FROM trades").fetchone()
+        return row["t"]
+
+    def find_trade(self, symbol, orderId, t):
+        row = self.db.execute("SELECT trade_id FROM orders WHERE symbol = ? AND order_id = ?",
+                              (symbol, orderId)).fetchone()
+        if row:
+            return row["trade_id"]
+
+        # Orders the bot did not register (e.g. failsafe market closes)
+        return self.find_open_trade(symbol, t)
+
+    def find_open_trade(self, symbol, t):
+        """Return the only trade on symbol open at time t (ms), or None."""
+        rows = self.db.execute(
+            "SELECT trade_id FROM trades WHERE symbol = ? AND opened_at <= ? "
+            "AND (closed_at IS NULL OR closed_at >= ?)",
+            (symbol, t, t)).fetchall()
+        if len(rows) == 1:
+            return rows[0]["trade_id"]
+        return None
+
+    def sync(self, symbol):
+        """Pull new account trades for symbol and new income history."""
+        with self.lock:
+            try:
+                fills = self.sync_fills(symbol)
+                income = self.sync_income()
+            except BinanceAPIException as e:
+                self.log.exception("BinanceAPIException: %s", e)
+                return False
+            except Exception as e:
+                self.log.exception("Unexpected Error: %s", e)
+                return False
+
+        self.log.info("Ledger sync %s: %s new fills, %s new income rows",
+                      symbol, fills, income)
+        return True
+
+    def sync_fills(self, symbol):
+        name = "fills:%s" % symbol
+        fromId = self.get_cursor(name)
+        count = 0
+        while True:
+            if fromId is None:
+                startTime = self.first_opened_at(symbol)
+                if startTime is None:
+                    return count
+                page = self.client.futures_account_trades(
+                    symbol=symbol, startTime=startTime, limit=TradeLedger.PAGE_LIMIT)
+            else:
+                page = self.client.futures_account_trades(
+                    symbol=symbol, fromId=fromId, limit=TradeLedger.PAGE_LIMIT)
+            self.log.debug("futures_account_trades: %s", pprint.pformat(page))
+            if not page:
+                return count
+
+            with self.db:
+                for fill in page:
+                    count += self.insert_fill(fill)
+                fromId = max(int(f["id"]) for f in page) + 1
+                self.set_cursor(name, fromId)
+
+            if len(page) < TradeLedger.PAGE_LIMIT:
+                return count
+
+    def insert_fill(self, fill):
+        symbol = fill["symbol"]
+        orderId = int(fill["orderId"])
+        t = int(fill["time"])
+        tradeId = self.find_trade(symbol, orderId, t)
+        realizedPnl = float(fill["realizedPnl"])
+        commission = float(fill["commission"])
+        commissionAsset = fill["commissionAsset"]
+
+        cur = self.db.execute(
+            "INSERT OR IGNORE INTO fills (symbol, id, order_id, trade_id, side, price, qty, "
+            "realized_pnl, commission, commission_asset, time) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (symbol, int(fill["id"]), orderId, tradeId, fill["side"],
+             float(fill["price"]), float(fill["qty"]), realizedPnl,
+             commission, commissionAsset, t))
+        if cur.rowcount != 1:
+            return 0
+
+        if tradeId:
+            fees = commission if commissionAsset == TradeLedger.ASSET else 0.0
+            self.db.execute(
+                "UPDATE trades SET realized_pnl = realized_pnl + ?, fees = fees + ? "
+                "WHERE trade_id = ?",
+                (realizedPnl, fees, tradeId))
+        return 1
+
+    def sync_income(self):
+        name = "income"
+        startTime = self.get_cursor(name)
+        if startTime is None:
+            startTime = self.first_opened_at()
+            if startTime is None:
+                return 0
+
+        count = 0
+        while True:
+            # Only funding is attributed here; realized PnL and commission
+            # come from the fills
+            page = self.client.futures_income_history(
+                incomeType="FUNDING_FEE", startTime=startTime, limit=TradeLedger.PAGE_LIMIT)
+            self.log.debug("futures_income_history: %s", pprint.pformat(page))
+            if not page:
+                return count
+
+            new = 0
+            with self.db:
+                for row in page:
+                    new += self.insert_income(row)
+                # Rows sharing the last timestamp are re-read and deduplicated
+                startTime = max(int(r["time"]) for r in page)
+                self.set_cursor(name, startTime)
+            count += new
+
+            if len(page) < TradeLedger.PAGE_LIMIT or new == 0:
+                return count
+
+    def insert_income(self, row):
+        symbol = row.get("symbol") or None
+        incomeType = row["incomeType"]
+        income = float(row["income"])
+        t = int(row["time"])
+
+        tradeId = None
+        if symbol and incomeType == "FUNDING_FEE":
+            tradeId = self.find_open_trade(symbol, t)
+
+        cur = self.db.execute(
+            "INSERT OR IGNORE INTO income (tran_id, income_type, asset, symbol, income, time, trade_id) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (int(row["tranId"]), incomeType, row["asset"], symbol, income, t, tradeId))
+        if cur.rowcount != 1:
+            return 0
+
+        if tradeId:
+            self.db.execute("UPDATE trades SET funding = funding + ? WHERE trade_id = ?",
+                            (income, tradeId))
+        return 1
+
+    # Queries
+
+    def get_trade(self, trade_id):
+        """Return realized_pnl, fees, funding and net for trade_id."""
+        with self.lock:
+            row = self.db.execute("SELECT * FROM trades WHERE trade_id = ?",
+                                  (trade_id,)).fetchone()
+        if row is None:
+            return None
+        trade = dict(row)
+        trade["net"] = trade["realized_pnl"] - trade["fees"] + trade["funding"]
+        return trade
+
+    def get_order_pnl(self, symbol, orderId):
+        """Return (realized_pnl, fees, qty) for the fills of one order."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT COALESCE(SUM(realized_pnl), 0) AS pnl, "
+                "COALESCE(SUM(CASE WHEN commission_asset = ? THEN commission ELSE 0 END), 0) AS fees, "
+                "COALESCE(SUM(qty), 0) AS qty "
+                "FROM fills WHERE symbol = ? AND order_id = ?",
+                (TradeLedger.ASSET, symbol, int(orderId))).fetchone()
+        return row["pnl"], row["fees"], row["qty"]
+
+    def summary(self, since=None, until=None, symbol=None):
+        """Totals over trades closed in [since, until) (times in ms)."""
+        query = ("SELECT COUNT(*) AS trades, COALESCE(SUM(realized_pnl), 0) AS realized_pnl, "
+                 "COALESCE(SUM(fees), 0) AS fees, COALESCE(SUM(funding), 0) AS funding "
+                 "FROM trades WHERE closed_at IS NOT NULL")
+        params = []
+        if since is not None:
+            query += " AND closed_at >= ?"
+            params.append(since)
+        if until is not None:
+            query += " AND closed_at < ?"
+            params.append(until)
+        if symbol:
+            query += " AND symbol = ?"
+            params.append(symbol)
+
+        with self.lock:
+            summary = dict(self.db.execute(query, params).fetchone())
+        summary["net"] = summary["realized_pnl"] - summary["fees"] + summary["funding"]
+        return summary
@@ -3,9 +3,12 @@ import os
 import pprint
 import time
 
+import account
+import execution
+import ledger
+import recorder
 import util
 
-from binance.client import Client
 from binance.exceptions import BinanceAPIException
 
 class OrderMgr:
@@ -13,8 +16,11 @@ class OrderMgr:
     STATE_CONFIG = "state.cfg"
 
     def __init__(self, api_key, api_secret):
-        self.client = Client(api_key, api_secret)
+        self.client = recorder.make_client(api_key, api_secret)
         self.log = util.getLogger("order_mgr")
+        self.account = account.get_snapshot(api_key, api_secret)
+        self.ledger = ledger.get_ledger(api_key, api_secret)
+        self.exchange_info = None
         self.config = configparser.ConfigParser()
         try:
             self.config.read(OrderMgr.STATE_CONFIG)
@@ -38,51 +44,27 @@ class OrderMgr:
 
         return success
 
-    def get_quantity_precision(self, symbol):    
-        info = self.client.futures_exchange_info() 
-        info = info['symbols']
+    def get_symbol_info(self, symbol):
+        # Exchange info is fetched once per OrderMgr (i.e. per alert)
+        if self.exchange_info is None:
+            self.exchange_info = self.client.futures_exchange_info()
+        info = self.exchange_info['symbols']
         for x in range(len(info)):
             if info[x]['symbol'] == symbol:
-                return info[x]['quantityPrecision']
+                return info[x]
         return None
 
-    def get_price_precision(self, symbol):    
-        info = self.client.futures_exchange_info() 
-        info = info['symbols']
-        for x in range(len(info)):
-            if info[x]['symbol'] == symbol:
-                return info[x]['pricePrecision']
+    def get_quantity_precision(self, symbol):    
+        info = self.get_symbol_info(symbol)
+        if info:
+            return info['quantityPrecision']
         return None
 
-    def get_balance(self, symbol="USDT", timeout=0, sleep=1):
-        self.log.info("Get balance for %s", symbol)
-        balance = 0.0
-        balances = None
-        t0 = time.time()
-        while balances is None:
-            if timeout > 0:
-                t1 = time.time()
-                if (t1 - t0) > timeout:
-                    self.log.warning("Timeout: Exceeded %s seconds", timeout)
-                    return balance
-
-            try:
-                balances = self.client.futures_account_balance()
-                self.log.debug("futures_account_balance: %s",
-                               pprint.pformat(balances))
-            except BinanceAPIException as e:
-                self.log.exception("BinanceAPIException: %s", e)
-            except Exception as e:
-                self.log.exception("Unexpected Error: %s", e)
-            finally:
-                time.sleep(sleep)
-
-        for b in balances:
-            if b["asset"] == symbol:
-                balance = float(b["balance"])
-                break
-
-        return balance
+    def get_price_precision(self, symbol):    
+        info = self.get_symbol_info(symbol)
+        if info:
+            return info['pricePrecision']
+        return None
 
     def create_order(self, orderType=None, symbol=None, side=None,
                      quantity=None, price=0.0, timeout=0, sleep=1, stopPrice=0.0, 
@@ -148,62 +130,9 @@ class OrderMgr:
 
         return order
 
-    def get_order(self, symbol, orderId, status=[], timeout=0, sleep=1):
-        self.log.info("Get %s order with ID: %s", symbol, orderId)
-        order = None
-        t0 = time.time()
-        while order is None:
-            if timeout > 0:
-                t1 = time.time()
-                if (t1 - t0) > timeout:
-                    self.log.warning("Timeout: Exceeded %s seconds", timeout)
-                    return
-
-            try:
-                order = self.client.futures_get_order(symbol=symbol,
-                                                      orderId=orderId)
-                self.log.debug("futures_get_order: %s", pprint.pformat(order))
-                if order:
-                    # Check that order has given status
-                    if status and order["status"] not in status:
-                        self.log.warning("Order status: %s, waiting to be %s",
-                                         order["status"], " or ".join(status))
-                        order = None
-            except BinanceAPIException as e:
-                self.log.exception("BinanceAPIException: %s", e)
-            except Exception as e:
-                self.log.exception("Unexpected Error: %s", e)
-            finally:
-                time.sleep(sleep)
-
-        return order
-
-    def get_open_orders(self, symbol, timeout=0, sleep=1):
-        self.log.info("Get open orders for %s", symbol)
-        orders = None
-        t0 = time.time()
-        while orders is None:
-            if timeout > 0:
-                t1 = time.time()
-                if (t1 - t0) > timeout:
-                    self.log.warning("Timeout: Exceeded %s seconds", timeout)
-                    return []
-
-            try:
-                orders = self.client.futures_get_open_orders(symbol=symbol)
-                self.log.debug("futures_get_open_orders: %s",
-                               pprint.pformat(orders))
-            except BinanceAPIException as e:
-                self.log.exception("BinanceAPIException: %s", e)
-            except Exception as e:
-                self.log.exception("Unexpected Error: %s", e)
-
-        return orders
-
-    def send_order(self, data, api_key, api_secret, timeout=120.0):
+    def send_order(self, data, api_key, api_secret, timeout=None):
         self.log.info("Send order: %s", pprint.pformat(data))
 
-        orderType = data["type"]
         symbol = data["symbol"]
         side = data["side"]
         price = float(data["price"])
@@ -215,7 +144,7 @@ class OrderMgr:
         precision_price = self.get_price_precision(symbol)
         precision_quantity = self.get_quantity_precision(symbol)
         # Adjust order quantity
-        balance = self.get_balance()
+        balance = self.account.get_balance()
         percentage = percentageVal / 100.0
 
         stopLossAmt = abs(price - stopLoss)
@@ -228,65 +157,72 @@ class OrderMgr:
         self.log.debug("stopLossAmt=%.2f, maxStopLossAmt=%.2f, quantity=%s",
                        stopLossAmt, maxStopLossAmt, quantity)
 
-        # Create new order
-        t0 = time.time()
-        order = self.create_order(orderType=orderType, symbol=symbol,
-                                  side=side, quantity=quantity, price=price,
-                                  timeout=timeout)
-        t1 = time.time()
-        timeout -= (t1 - t0)
-        if timeout <= 0.0:
-            self.client.futures_cancel_all_open_orders(symbol=symbol)
-            util.sendTelegram("Order Limit Timeout: Exceeded 2 minutes")
-            return False
+        # Work the entry order
+        openedAt = ledger.now_ms()
+        tradeId = "{0}-{1}".format(symbol, openedAt)
+        mode = data.get("execution", execution.DEFAULT_MODE)
+        executor = execution.EntryExecutor(self.client, precision_price, precision_quantity,
+                                           account=self.account)
+        order = executor.execute(symbol, side, quantity, price, mode=mode,
+                                 timeout=timeout)
+
+        # Nothing of the entry may stay live, and whatever is open needs
+        # protecting, whether the executor or the position saw it first
+        self.log.info("Cancel all open orders for %s", symbol)
+        self.client.futures_cancel_all_open_orders(symbol=symbol)
+        positionAmt = abs(self.account.get_position_amt(symbol))
+        positionAmt = float("{0:.{1}f}".format(positionAmt, precision_quantity))
+        if positionAmt != order["executedQty"] or order["unresolved"]:
+            # The stream may lag the fills, ask the exchange once
+            try:
+                openPosition = self.client.futures_position_information(symbol=symbol)
+                positionAmt = sum(abs(float(p["positionAmt"])) for p in openPosition
+                                  if p["symbol"] == symbol)
+                positionAmt = float("{0:.{1}f}".format(positionAmt, precision_quantity))
+            except BinanceAPIException as e:
+                self.log.exception("BinanceAPIException: %s", e)
+            except Exception as e:
+                self.log.exception("Unexpected Error: %s", e)
 
-        if order is None:
-            self.log.error("Could not create order")
+        if positionAmt != order["executedQty"]:
+            self.log.warning("Entry filled %s but position is %s for %s",
+                             order["executedQty"], positionAmt, symbol)
+        # Never protect less than the executor saw filled
+        positionAmt = max(positionAmt, order["executedQty"])
+        order["executedQty"] = positionAmt
+        if not order["avgPrice"]:
+            order["avgPrice"] = price
+
+        if positionAmt <= 0.0:
+            self.log.error("Entry order not filled for %s", symbol)
+            util.sendTelegram("Entry Timeout: {0} order for {1} not filled ({2})".format(
+                side, symbol, order["mode"]))
             return False
 
+        # Only filled entries are recorded as trades
+        self.ledger.open_trade(tradeId, symbol, side=side, strategy=strategy,
+                               opened_at=openedAt)
+        for orderId in order["orderIds"]:
+            self.ledger.add_order(tradeId, symbol, orderId)
+
         # Send telegram
-        message = ("Create New Order for: {4}\nStrategy: {9}\nInterval: {10}\nSide: {5}\nPercentage: {6}\nPrice: ${0:,.2f}\nQuantity: {3:.2f}\nTake Profit: ${1:,.2f}\nStop Loss: ${2:,.2f}\nOpening Balance: ${8:,.2f}\nMax Loss: ${7:,.2f}".format(
-                    price, takeProfit, stopLoss, quantity, symbol, side, percentage, maxStopLossAmt, balance, strategy, interval))
+        message = ("Create New Order for: {4}\nStrategy: {9}\nInterval: {10}\nSide: {5}\nPercentage: {6}\nPrice: ${0:,.2f}\nQuantity: {3:.2f}\nTake Profit: ${1:,.2f}\nStop Loss: ${2:,.2f}\nOpening Balance: ${8:,.2f}\nMax Loss: ${7:,.2f}\nExecution: {11}, latency {12:.1f}s".format(
+                    order["avgPrice"], takeProfit, stopLoss, order["executedQty"], symbol, side, percentage, maxStopLossAmt, balance, strategy, interval,
+                    order["mode"], order["latency"]))
 
         util.sendTelegram(message)
 
-        # Get order by ID
-        orderId = order["orderId"]
-        t0 = time.time()
-        order = self.get_order(symbol, orderId,
-                               status=["FILLED", "PARTIALLY_FILLED"],
-                               timeout=timeout)
-        t1 = time.time()
-        timeout -= (t1 - t0)
-        if timeout <= 0.0:
-            self.client.futures_cancel_all_open_orders(symbol=symbol)
-            util.sendTelegram("Order Limit Timeout: Exceeded 2 minutes")
-            return False
-
-        if order is None:
-            self.log.error("Could not get order with ID: %s", orderId)
-            self.log.info("Cancel all open orders for %s", symbol)
-            self.client.futures_cancel_all_open_orders(symbol=symbol)
-            util.sendTelegram("Order Limit Timeout: Exceeded 2 minutes")
-            return False
-
-        if order["status"] == "PARTIALLY_FILLED":
-            # Wait a little more time to see if order fills
-            time.sleep(5)
-            order = self.client.futures_get_order(symbol=symbol,
-                                                  orderId=orderId)
-            self.log.info("Cancel all open orders for %s", symbol)
-            self.client.futures_cancel_all_open_orders(symbol=symbol)
-
         if side == "BUY":
-            self.send_long_orders(order, takeProfit, stopLoss, balance, strategy, api_key, api_secret)
+            self.send_long_orders(order, takeProfit, stopLoss, tradeId, strategy, api_key, api_secret,
+                                  positionAmt)
         else:
-            self.send_short_orders(order, takeProfit, stopLoss, balance, strategy, api_key, api_secret)
+            self.send_short_orders(order, takeProfit, stopLoss, tradeId, strategy, api_key, api_secret,
+                                   positionAmt)
 
         return True
 
     def create_stop_loss_trailing_order(self, symbol, side, stop_loss_orderType, 
-        stop_loss, iteration, positionAmt):
+        stop_loss, iteration, positionAmt, trade_id=None):
 
         message = ("Moving Stop Loss ({0}), symbol={1}new stop_price={2:,.2f}, positionAmt={3}".format(iteration, symbol, stop_loss, positionAmt))
         self.log.info(message)
@@ -294,15 +230,17 @@ class OrderMgr:
 
         stop_loss_order = self.create_order(orderType=stop_loss_orderType, symbol=symbol,
             side=side, stopPrice=stop_loss, positionAmt=positionAmt)
+        if trade_id:
+            self.ledger.add_order(trade_id, symbol, stop_loss_order)
 
         return stop_loss_order
 
-    def send_short_orders(self, order, take_profit, stop_loss, open_balance, strategy, api_key, api_secret):
+    def send_short_orders(self, order, take_profit, stop_loss, trade_id, strategy, api_key, api_secret,
+        positionAmt):
         self.log.info("Set TP and SL short order: take_profit=%s, stop_loss=%s",
                        take_profit, stop_loss)
         self.log.debug(pprint.pformat(order))
 
-        open_balance=float(open_balance)
         take_profit_orderType = "TAKE_PROFIT_MARKET"
         stop_loss_orderType = "STOP_MARKET"
         side = "BUY"
@@ -317,14 +255,10 @@ class OrderMgr:
         # if strategy == "scalp":
         #     quantity_multiplier = 1 
 
-        openPosition = self.client.futures_position_information(symbol=symbol)
-        for p in openPosition:
-            if p["symbol"] == symbol:
-                positionAmt = abs(float(p["positionAmt"]))
-
         stop_loss_order = self.create_order(
             symbol=symbol, side=side, orderType=stop_loss_orderType,
             stopPrice=stop_loss, positionAmt=positionAmt)
+        self.ledger.add_order(trade_id, symbol, stop_loss_order)
 
         self.log.debug("Stop loss order: %s", pprint.pformat(stop_loss_order))
 
@@ -333,6 +267,7 @@ class OrderMgr:
             take_profit_dict["take_profit_order%s" %number] = self.create_order(orderType=take_profit_orderType, symbol=symbol,
                 side=side, quantity=order_quantity, stopPrice=take_profit, 
                 positionAmt=positionAmt)
+            self.ledger.add_order(trade_id, symbol, take_profit_dict["take_profit_order%s" %number])
             order_quantity = float(order_quantity) * 0.3
             take_profit = take_profit - atr * 0.5
             time.sleep(1)
@@ -342,7 +277,7 @@ class OrderMgr:
         stop_loss_order_status = "NEW"
         while stop_loss_order_status != "FILLED" and iteration < 6:
 
-            self.client = Client(api_key, api_secret)
+            self.client = recorder.make_client(api_key, api_secret)
             self.log.debug("TP{0} and SL{0} positions are still open".format(iteration))
             
             stop_loss_order = self.client.futures_get_order(symbol=symbol, orderId=stop_loss_order['orderId'])            
@@ -354,18 +289,16 @@ class OrderMgr:
             take_profit_order_status = take_profit_get_order["status"]
             take_profit_quantity = take_profit_get_order["executedQty"]
 
-            openPosition = self.client.futures_position_information(symbol=symbol)
-            for p in openPosition:
-                if p["symbol"] == symbol:
-                    positionAmt = abs(float(p["positionAmt"]))
+            positionAmt = abs(self.account.get_position_amt(symbol))
 
             if positionAmt == 0.0: 
                 break
 
             if take_profit_order_status == "FILLED":
-                profitPrice = float(take_profit_get_order["avgPrice"])
-                profit = (price - profitPrice) * float(take_profit_quantity)
-                self.log.info("price= {0}, profitPrice= {1}, quantity= {2}".format(price, profitPrice, take_profit_quantity))
+                self.ledger.sync(symbol)
+                profit, fees, _ = self.ledger.get_order_pnl(symbol, take_profit_oder_id)
+                self.log.info("price= {0}, profitPrice= {1}, quantity= {2}, fees= {3}".format(
+                    price, take_profit_get_order["avgPrice"], take_profit_quantity, fees))
                 message = "TP{0} Profit: ${1:.2f}, symbol: {2}".format(iteration, profit, symbol)
                 self.log.info(message)
                 util.sendTelegram(message)
@@ -375,36 +308,41 @@ class OrderMgr:
                 if iteration == 1:
                     stop_loss = price + (atr * atr_multiplier)
                     stop_loss_order = self.create_stop_loss_trailing_order(symbol, side, stop_loss_orderType, 
-                                  stop_loss, iteration, positionAmt)
+                                  stop_loss, iteration, positionAmt, trade_id)
                 elif iteration >= 3 :
                     stop_loss = price - (atr * atr_multiplier * (iteration-2)) # move stopLoss to 50% atr increments after TP3 reached
                     stop_loss_order = self.create_stop_loss_trailing_order(symbol, side, stop_loss_orderType, 
-                                  stop_loss, iteration, positionAmt)
+                                  stop_loss, iteration, positionAmt, trade_id)
                 iteration += 1
             time.sleep(1)
 
         self.log.info("SL{0}: Cancelling all open orders for {1}".format(iteration, symbol))
         self.client.futures_cancel_all_open_orders(symbol=symbol)
-        end_balance = self.get_balance()
-        loss = end_balance - open_balance
-        message = "Total Profit/Loss: ${0:.2f}, symbol: {1}\nEnding Balance: ${2:,.2f}".format(loss, symbol, end_balance)
-        self.log.info(message)
-        util.sendTelegram(message)
         #add one last failsafe
         openPosition = self.client.futures_position_information(symbol=symbol)
         for p in openPosition:
             if p["symbol"] == symbol:
                 positionAmt = abs(float(p["positionAmt"]))
                 if positionAmt != 0.0: 
-                    self.client.futures_create_order(symbol=symbol, side=side, 
+                    failsafe_order = self.client.futures_create_order(symbol=symbol, side=side, 
                     type='MARKET', quantity=positionAmt, reduceOnly='true')
+                    self.ledger.add_order(trade_id, symbol, failsafe_order)
+
+        self.ledger.close_trade(trade_id)
+        self.ledger.sync(symbol)
+        trade = self.ledger.get_trade(trade_id)
+        end_balance = self.account.get_balance()
+        message = "Total Profit/Loss: ${0:.2f} (fees ${3:.2f}, funding ${4:.2f}), symbol: {1}\nEnding Balance: ${2:,.2f}".format(
+            trade["net"], symbol, end_balance, trade["fees"], trade["funding"])
+        self.log.info(message)
+        util.sendTelegram(message)
 
-    def send_long_orders(self, order, take_profit, stop_loss, open_balance, strategy, api_key, api_secret):
+    def send_long_orders(self, order, take_profit, stop_loss, trade_id, strategy, api_key, api_secret,
+        positionAmt):
         self.log.info("Set TP and SL short order: take_profit=%s, stop_loss=%s",
                        take_profit, stop_loss)
         self.log.debug(pprint.pformat(order))
 
-        open_balance=float(open_balance)
         take_profit_orderType = "TAKE_PROFIT_MARKET"
         stop_loss_orderType = "STOP_MARKET"
         side = "SELL"
@@ -419,14 +357,10 @@ class OrderMgr:
         # if strategy == "scalp":
         #     quantity_multiplier = 1 
 
-        openPosition = self.client.futures_position_information(symbol=symbol)
-        for p in openPosition:
-            if p["symbol"] == symbol:
-                positionAmt = abs(float(p["positionAmt"]))
-
         stop_loss_order = self.create_order(
             symbol=symbol, side=side, orderType=stop_loss_orderType,
             stopPrice=stop_loss, positionAmt=positionAmt)
+        self.ledger.add_order(trade_id, symbol, stop_loss_order)
 
         self.log.debug("Stop loss order: %s", pprint.pformat(stop_loss_order))
 
@@ -435,6 +369,7 @@ class OrderMgr:
             take_profit_dict["take_profit_order%s" %number] = self.create_order(orderType=take_profit_orderType, symbol=symbol,
                 side=side, quantity=order_quantity, stopPrice=take_profit, 
                 positionAmt=positionAmt)
+            self.ledger.add_order(trade_id, symbol, take_profit_dict["take_profit_order%s" %number])
             order_quantity = float(order_quantity) * 0.3
             take_profit = take_profit + atr * 0.5
             time.sleep(1)
@@ -444,7 +379,7 @@ class OrderMgr:
         stop_loss_order_status = "NEW"
         while stop_loss_order_status != "FILLED" and iteration < 6:
 
-            self.client = Client(api_key, api_secret)
+            self.client = recorder.make_client(api_key, api_secret)
             self.log.debug("TP{0} and SL{0} positions are still open".format(iteration))
             
             stop_loss_order = self.client.futures_get_order(symbol=symbol, orderId=stop_loss_order['orderId'])            
@@ -456,18 +391,16 @@ class OrderMgr:
             take_profit_order_status = take_profit_get_order["status"]
             take_profit_quantity = take_profit_get_order["executedQty"]
 
-            openPosition = self.client.futures_position_information(symbol=symbol)
-            for p in openPosition:
-                if p["symbol"] == symbol:
-                    positionAmt = abs(float(p["positionAmt"]))
+            positionAmt = abs(self.account.get_position_amt(symbol))
 
             if positionAmt == 0.0: 
                 break
 
             if take_profit_order_status == "FILLED":
-                profitPrice = float(take_profit_get_order["avgPrice"])
-                profit = (profitPrice - price) * float(take_profit_quantity)
-                self.log.info("price= {0}, profitPrice= {1}, quantity= {2}".format(price, profitPrice, take_profit_quantity))
+                self.ledger.sync(symbol)
+                profit, fees, _ = self.ledger.get_order_pnl(symbol, take_profit_oder_id)
+                self.log.info("price= {0}, profitPrice= {1}, quantity= {2}, fees= {3}".format(
+                    price, take_profit_get_order["avgPrice"], take_profit_quantity, fees))
                 message = "TP{0} Profit: ${1:.2f}, symbol: {2}".format(iteration, profit, symbol)
                 self.log.info(message)
                 util.sendTelegram(message)
@@ -478,26 +411,31 @@ class OrderMgr:
                 if iteration == 1:
                     stop_loss = price - (atr * atr_multiplier)
                     stop_loss_order = self.create_stop_loss_trailing_order(symbol, side, stop_loss_orderType, 
-                                  stop_loss, iteration, positionAmt)
+                                  stop_loss, iteration, positionAmt, trade_id)
                 elif iteration >= 3 :
                     stop_loss = price + (atr * atr_multiplier * (iteration-2)) # move stopLoss to 50% atr increments after TP3 reached
                     stop_loss_order = self.create_stop_loss_trailing_order(symbol, side, stop_loss_orderType, 
-                                  stop_loss, iteration, positionAmt)
+                                  stop_loss, iteration, positionAmt, trade_id)
                 iteration += 1
             time.sleep(1)
 
         self.log.info("SL{0}: Cancelling all open orders for {1}".format(iteration, symbol))
         self.client.futures_cancel_all_open_orders(symbol=symbol)
-        end_balance = self.get_balance()
-        loss = end_balance - open_balance
-        message = "Total Profit/Loss: ${0:.2f}, symbol: {1}\nEnding Balance: ${2:,.2f}".format(loss, symbol, end_balance)
-        self.log.info(message)
-        util.sendTelegram(message)
         #add one last failsafe
         openPosition = self.client.futures_position_information(symbol=symbol)
         for p in openPosition:
             if p["symbol"] == symbol:
                 positionAmt = abs(float(p["positionAmt"]))
                 if positionAmt != 0.0: 
-                    self.client.futures_create_order(symbol=symbol, side=side, 
-                    type='MARKET', quantity=positionAmt, reduceOnly='true')
\ No newline at end of file
+                    failsafe_order = self.client.futures_create_order(symbol=symbol, side=side, 
+                    type='MARKET', quantity=positionAmt, reduceOnly='true')
+                    self.ledger.add_order(trade_id, symbol, failsafe_order)
+
+        self.ledger.close_trade(trade_id)
+        self.ledger.sync(symbol)
+        trade = self.ledger.get_trade(trade_id)
+        end_balance = self.account.get_balance()
+        message = "Total Profit/Loss: ${0:.2f} (fees ${3:.2f}, funding ${4:.2f}), symbol: {1}\nEnding Balance: ${2:,.2f}".format(
+            trade["net"], symbol, end_balance, trade["fees"], trade["funding"])
+        self.log.info(message)
+        util.sendTelegram(message)
\ No newline at end of file
@@ -0,0 +1,149 @@
+# Session recorder.  Every exchange client is created through make_client(),
+# and while a recording runs each client call, user data stream event and
+# webhook alert is appended to a JSONL log, one record per line:
+#
+#   {"t": 1700000000.123, "k": "call", "m": "futures_get_order",
+#    "a": {"symbol": "BTCUSDT", "orderId": 1}, "r": {...}, "d": 0.084}
+#   {"t": ..., "k": "event", "r": {"e": "ACCOUNT_UPDATE", ...}}
+#   {"t": ..., "k": "alert", "r": {"symbol": "BTCUSDT", ...}}
+#
+# A path ending in .gz is written gzip compressed.  Repeated responses such as
+# futures_exchange_info differ in their timestamps, so they compress well but
+# do not deduplicate.  Every record is flushed, so a log cut short by a crash
+# still reads up to its last complete record.
+
+import gzip
+import json
+import threading
+import time
+
+import util
+
+from binance.client import Client
+
+_recorder = None
+# Set by replay.py: factory(api_key, api_secret) -> client and
+# subscribe(callback) for user data stream events
+_replay = None
+
+
+def open_log(path, mode="r"):
+    """Open a session log as text, gzip compressed if path ends in .gz."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class Recorder:
+
+    def __init__(self, path):
+        self.path = path
+        self.log = util.getLogger("recorder")
+        self.lock = threading.Lock()
+        # Appending to a .gz file adds a gzip member, which reads back as one
+        self.file = open_log(path, "a")
+        self.log.info("Recording session to %s", path)
+
+    def dumps(self, record):
+        return json.dumps(record, separators=(",", ":"), default=str)
+
+    def write(self, kind, **fields):
+        record = {"t": time.time(), "k": kind}
+        record.update(fields)
+        line = self.dumps(record)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def write_call(self, method, args, kwargs, duration, result=None, error=None):
+        fields = {"m": method, "p": args, "a": kwargs, "d": duration}
+        if error is not None:
+            fields["e"] = error
+        else:
+            fields["r"] = result
+        self.write("call", **fields)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class RecordingClient:
+    """Proxy for a binance Client that records every method call."""
+
+    def __init__(self, client, recorder):
+        self._client = client
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            t0 = time.time()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as e:
+                self._recorder.write_call(name, list(args), kwargs, time.time() - t0,
+                                          error=str(e))
+                raise
+            self._recorder.write_call(name, list(args), kwargs, time.time() - t0,
+                                      result=result)
+            return result
+
+        return call
+
+
+def start(path):
+    global _recorder
+    if _recorder is None:
+        _recorder = Recorder(path)
+    return _recorder
+
+
+def stop():
+    global _recorder
+    if _recorder is not None:
+        _recorder.close()
+    _recorder = None
+
+
+def make_client(api_key, api_secret):
+    """Create an exchange client, recorded or replayed when enabled."""
+    if _replay is not None:
+        return _replay.make_client(api_key, api_secret)
+
+    client = Client(api_key, api_secret)
+    if _recorder is not None:
+        return RecordingClient(client, _recorder)
+    return client
+
+
+def start_user_socket(api_key, api_secret, callback):
+    """
+    Subscribe callback to the futures user data stream and return the
+    websocket manager (with a stop() method).
+    """
+    if _replay is not None:
+        return _replay.subscribe(callback)
+
+    def on_event(event):
+        if _recorder is not None:
+            _recorder.write("event", r=event)
+        callback(event)
+
+    from binance import ThreadedWebsocketManager
+    twm = ThreadedWebsocketManager(api_key=api_key, api_secret=api_secret)
+    twm.start()
+    twm.start_futures_user_socket(callback=on_event)
+    return twm
+
+
+def record_alert(data):
+    if _recorder is None:
+        return
+    # Never write the webhook auth key
+    alert = dict(data)
+    alert.pop("key", None)
+    _recorder.write("alert", r=alert)
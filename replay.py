@@ -0,0 +1,269 @@
+# Replays a session recorded by recorder.py through OrderMgr.  Alerts are fed
+# to send_order one at a time, exchange calls are answered from the recording
+# and user data stream events are delivered at their recorded time.  The clock
+# is virtual: sleeps and recorded call durations advance it, and --speed > 0
+# also slows it down to that multiple of real time.
+#
+# Calls are matched by method, symbol and orderId in recorded order.  A call
+# with no recorded response left repeats the last one for that method, so the
+# report shows where a new version makes more (or fewer) round trips.  Replayed
+# on the code that recorded it, a session has no unmatched or unused calls.
+#
+#   python replay.py logs/session.jsonl.gz --output new.json --baseline old.json
+
+import argparse
+import collections
+import copy
+import json
+import sys
+import time
+
+import execution
+import ledger
+import recorder
+import util
+
+from order import OrderMgr
+
+REPLAY_KEY = "replay"
+TRADE_STRATEGIES = ("trend", "scalp", "highVol")
+
+_real_time = time.time
+_real_sleep = time.sleep
+
+
+class ReplayError(Exception):
+    pass
+
+
+class Clock:
+
+    def __init__(self, replayer, start, speed=0.0):
+        self.replayer = replayer
+        self.now = start
+        self.speed = speed
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        seconds = max(seconds, 0.0)
+        self.now += seconds
+        if self.speed > 0.0:
+            _real_sleep(seconds / self.speed)
+        self.replayer.dispatch_events()
+
+
+class ReplayClient:
+    """Answers client method calls from the recording."""
+
+    def __init__(self, replayer):
+        self._replayer = replayer
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            return self._replayer.call(name, kwargs)
+        return call
+
+
+class Replayer:
+
+    def __init__(self, path, speed=0.0):
+        self.log = util.getLogger("replay")
+        self.calls = collections.defaultdict(collections.deque)
+        self.last = {}
+        self.events = collections.deque()
+        self.alerts = []
+        self.callbacks = []
+        self.recorded = collections.Counter()
+        self.served = collections.Counter()
+        self.unmatched = collections.Counter()
+        self.exchange_time = 0.0
+        self.telegrams = 0
+
+        start = None
+        pending = []
+        for record in self.read(path):
+            if start is None:
+                start = record["t"]
+            if record["k"] == "call":
+                self.calls[self.key(record["m"], record.get("a", {}))].append(record)
+                self.recorded[record["m"]] += 1
+                # Events arriving while a call is in flight are logged
+                # before it
+                for event in pending:
+                    event["next"] = record
+                pending = []
+            elif record["k"] == "event":
+                self.events.append(record)
+                pending.append(record)
+            elif record["k"] == "alert":
+                self.alerts.append(record)
+
+        self.start = start or 0.0
+        self.clock = Clock(self, self.start, speed)
+
+    def read(self, path):
+        """Yield the records of a session log, up to a truncated last record."""
+        with recorder.open_log(path) as f:
+            try:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        self.log.warning("Truncated record in %s: %s", path, line[:80])
+                        return
+            except EOFError:
+                # Recording stopped without closing the gzip stream
+                self.log.warning("Session log %s ends early", path)
+
+    @staticmethod
+    def key(method, kwargs):
+        return (method, kwargs.get("symbol"), kwargs.get("orderId"))
+
+    # Hooks used by recorder.make_client and recorder.start_user_socket
+
+    def make_client(self, api_key, api_secret):
+        return ReplayClient(self)
+
+    def subscribe(self, callback):
+        self.callbacks.append(callback)
+        return self
+
+    def stop(self):
+        pass
+
+    def call(self, method, kwargs):
+        self.dispatch_events()
+        self.served[method] += 1
+
+        key = self.key(method, kwargs)
+        queue = self.calls.get(key)
+        if queue:
+            record = queue.popleft()
+            record["served"] = True
+            self.last[key] = record
+            self.last[method] = record
+        else:
+            self.unmatched[method] += 1
+            record = self.last.get(key) or self.last.get(method)
+            if record is None:
+                raise ReplayError("No recorded response for %s %s" % (method, kwargs))
+
+        duration = record.get("d", 0.0)
+        self.exchange_time += duration
+        self.clock.sleep(duration)
+        if "e" in record:
+            raise ReplayError(record["e"])
+        return copy.deepcopy(record.get("r"))
+
+    def dispatch_events(self):
+        while self.events and self.events[0]["t"] <= self.clock.now:
+            event = self.events[0]
+            # With equal timestamps the log order decides, so an event never
+            # comes before the call it was received during
+            nxt = event.get("next")
+            if event["t"] == self.clock.now and nxt is not None and not nxt.get("served"):
+                break
+            self.events.popleft()
+            for callback in self.callbacks:
+                callback(copy.deepcopy(event["r"]))
+
+    def send_telegram(self, message, *args, **kwargs):
+        self.telegrams += 1
+        self.log.info("Telegram: %s", message)
+        return {}
+
+    def run(self):
+        saved = (time.time, time.sleep, util.sendTelegram, ledger.LEDGER_DB)
+        time.time = self.clock.time
+        time.sleep = self.clock.sleep
+        util.sendTelegram = self.send_telegram
+        ledger.LEDGER_DB = ":memory:"
+        recorder._replay = self
+
+        t0 = _real_time()
+        try:
+            for alert in self.alerts:
+                if alert["t"] > self.clock.now:
+                    self.clock.sleep(alert["t"] - self.clock.now)
+                data = alert["r"]
+                self.log.info("Replay alert: %s %s %s", data.get("strategy"),
+                              data.get("side"), data.get("symbol"))
+                if data.get("strategy") not in TRADE_STRATEGIES:
+                    continue
+                try:
+                    mgr = OrderMgr(REPLAY_KEY, REPLAY_KEY)
+                    mgr.send_order(data, REPLAY_KEY, REPLAY_KEY)
+                except ReplayError as e:
+                    self.log.exception("Replay diverged: %s", e)
+        finally:
+            time.time, time.sleep, util.sendTelegram, ledger.LEDGER_DB = saved
+            recorder._replay = None
+
+        return self.report(_real_time() - t0)
+
+    def report(self, wall_time):
+        unused = collections.Counter()
+        for (method, _, _), queue in self.calls.items():
+            unused[method] += len(queue)
+
+        return {
+            "alerts": len(self.alerts),
+            "calls": sum(self.served.values()),
+            "recorded_calls": sum(self.recorded.values()),
+            "calls_by_method": dict(self.served),
+            "recorded_by_method": dict(self.recorded),
+            "unmatched_by_method": dict(self.unmatched),
+            "unused_by_method": {m: n for m, n in unused.items() if n},
+            "exchange_time": self.exchange_time,
+            "session_time": self.clock.now - self.start,
+            "wall_time": wall_time,
+            "telegrams": self.telegrams,
+            "execution": execution.stats.summary(),
+        }
+
+
+def compare(report, baseline):
+    """Return {method: (baseline calls, calls)} for methods whose count changed."""
+    old = baseline.get("calls_by_method", {})
+    new = report.get("calls_by_method", {})
+    diff = {}
+    for method in sorted(set(old) | set(new)):
+        if old.get(method, 0) != new.get(method, 0):
+            diff[method] = (old.get(method, 0), new.get(method, 0))
+    return diff
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded trading session")
+    parser.add_argument("path", help="session JSONL (.gz) written by recorder.py")
+    parser.add_argument("--speed", type=float, default=0.0,
+                        help="multiple of real time, 0 for as fast as possible")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    parser.add_argument("--baseline", help="report from a previous run to compare against")
+    args = parser.parse_args(argv)
+
+    report = Replayer(args.path, speed=args.speed).run()
+    print(json.dumps(report, indent=2, sort_keys=True))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        diff = compare(report, baseline)
+        for method, (old, new) in diff.items():
+            print("{0}: {1} -> {2}".format(method, old, new))
+        print("calls: {0} -> {1}, exchange time: {2:.3f}s -> {3:.3f}s".format(
+            baseline["calls"], report["calls"],
+            baseline["exchange_time"], report["exchange_time"]))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
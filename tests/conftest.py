@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # util.getLogger writes to logs/ under the working directory
+    os.mkdir(os.path.join(str(tmp_path), "logs"))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,191 @@
+import collections
+import itertools
+import threading
+import time
+
+
+class VirtualClock:
+    """Replaces time.time and time.sleep; sleeping runs the due callbacks."""
+
+    def __init__(self, start=1700000000.0):
+        self.now = start
+        self.pending = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(seconds, 0.0)
+        due = [p for p in self.pending if p[0] <= self.now]
+        self.pending = [p for p in self.pending if p[0] > self.now]
+        for _, callback in due:
+            callback()
+
+    def after(self, seconds, callback):
+        self.pending.append((self.now + seconds, callback))
+
+
+class FakeExchange:
+    """
+    In-memory stand-in for the binance futures client.  Counts every call,
+    fills orders against a fixed book and pushes ORDER_TRADE_UPDATE and
+    ACCOUNT_UPDATE events to the registered user data stream listeners.
+    """
+
+    def __init__(self, balance=1000.0, bid=100.0, ask=100.01,
+                 price_precision=2, quantity_precision=3):
+        self.calls = collections.Counter()
+        self.lock = threading.RLock()
+        self.balances = {"USDT": balance}
+        self.positions = {}
+        self.orders = {}
+        self.trades = []
+        self.income = []
+        self.listeners = []
+        # Set to simulate a user data stream that lags the fills
+        self.drop_events = False
+        self.bid = bid
+        self.ask = ask
+        self.price_precision = price_precision
+        self.quantity_precision = quantity_precision
+        # Fraction of a resting LIMIT order filled when it is placed
+        self.limit_fill = 0.0
+        self.order_ids = itertools.count(1)
+        self.trade_ids = itertools.count(1)
+
+    def call(self, name):
+        self.calls[name] += 1
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+        return self
+
+    def stop(self):
+        pass
+
+    def emit(self, event):
+        if self.drop_events:
+            return
+        for callback in list(self.listeners):
+            callback(event)
+
+    # Fills
+
+    def fill(self, orderId, qty, price):
+        with self.lock:
+            order = self.orders[orderId]
+            filled = float(order["executedQty"])
+            notional = filled * float(order["avgPrice"]) + qty * price
+            filled += qty
+            order["executedQty"] = str(filled)
+            order["avgPrice"] = str(notional / filled)
+            if filled >= float(order["origQty"]):
+                order["status"] = "FILLED"
+            else:
+                order["status"] = "PARTIALLY_FILLED"
+
+            symbol = order["symbol"]
+            signed = qty if order["side"] == "BUY" else -qty
+            self.positions[symbol] = self.positions.get(symbol, 0.0) + signed
+            self.trades.append({
+                "symbol": symbol, "id": next(self.trade_ids), "orderId": orderId,
+                "side": order["side"], "price": str(price), "qty": str(qty),
+                "realizedPnl": "0", "commission": str(qty * price * 0.0004),
+                "commissionAsset": "USDT", "time": int(time.time() * 1000),
+            })
+            order_event = {"e": "ORDER_TRADE_UPDATE", "o": {
+                "s": symbol, "i": orderId, "S": order["side"], "X": order["status"],
+                "z": order["executedQty"], "ap": order["avgPrice"]}}
+            account_event = {"e": "ACCOUNT_UPDATE", "a": {
+                "B": [], "P": [{"s": symbol, "pa": str(self.positions[symbol]), "ps": "BOTH"}]}}
+
+        self.emit(order_event)
+        self.emit(account_event)
+
+    # Client methods
+
+    def futures_exchange_info(self):
+        self.call("futures_exchange_info")
+        return {"symbols": [{"symbol": "BTCUSDT", "pricePrecision": self.price_precision,
+                             "quantityPrecision": self.quantity_precision}]}
+
+    def futures_account_balance(self):
+        self.call("futures_account_balance")
+        return [{"asset": a, "balance": str(b)} for a, b in self.balances.items()]
+
+    def futures_position_information(self, symbol=None):
+        self.call("futures_position_information")
+        return [{"symbol": s, "positionAmt": str(p), "positionSide": "BOTH"}
+                for s, p in self.positions.items() if symbol in (None, s)]
+
+    def futures_orderbook_ticker(self, symbol):
+        self.call("futures_orderbook_ticker")
+        return {"symbol": symbol, "bidPrice": str(self.bid), "askPrice": str(self.ask)}
+
+    def futures_create_order(self, **params):
+        self.call("futures_create_order")
+        qty = float(params.get("quantity") or 0.0)
+        if qty <= 0.0 and not params.get("closePosition"):
+            raise ValueError("Quantity less than or equal to zero")
+
+        orderId = next(self.order_ids)
+        order = {"orderId": orderId, "symbol": params["symbol"], "side": params["side"],
+                 "type": params["type"], "status": "NEW", "origQty": str(qty),
+                 "executedQty": "0", "avgPrice": "0", "price": params.get("price", "0")}
+        with self.lock:
+            self.orders[orderId] = order
+
+        buy = params["side"] == "BUY"
+        if params["type"] == "MARKET":
+            self.fill(orderId, qty, self.ask if buy else self.bid)
+        elif params["type"] == "LIMIT":
+            price = float(params["price"])
+            crosses = price >= self.ask if buy else price <= self.bid
+            if crosses and params.get("timeInForce") == "GTX":
+                order["status"] = "EXPIRED"
+            elif crosses:
+                self.fill(orderId, qty, self.ask if buy else self.bid)
+            elif self.limit_fill > 0.0:
+                step = 10 ** -self.quantity_precision
+                part = round(qty * self.limit_fill / step) * step
+                if part > 0.0:
+                    self.fill(orderId, part, price)
+        return dict(order)
+
+    def futures_get_order(self, symbol, orderId):
+        self.call("futures_get_order")
+        return dict(self.orders[orderId])
+
+    def futures_cancel_order(self, symbol, orderId):
+        self.call("futures_cancel_order")
+        order = self.orders[orderId]
+        if order["status"] not in ("NEW", "PARTIALLY_FILLED"):
+            raise ValueError("Unknown order sent")
+        order["status"] = "CANCELED"
+        self.emit({"e": "ORDER_TRADE_UPDATE", "o": {
+            "s": symbol, "i": orderId, "S": order["side"], "X": "CANCELED",
+            "z": order["executedQty"], "ap": order["avgPrice"]}})
+        return dict(order)
+
+    def futures_cancel_all_open_orders(self, symbol):
+        self.call("futures_cancel_all_open_orders")
+        for order in self.orders.values():
+            if order["symbol"] == symbol and order["status"] in ("NEW", "PARTIALLY_FILLED"):
+                order["status"] = "CANCELED"
+        return {"code": 200}
+
+    def futures_account_trades(self, symbol, limit=500, fromId=None, startTime=None):
+        self.call("futures_account_trades")
+        rows = [t for t in self.trades if t["symbol"] == symbol]
+        if fromId is not None:
+            rows = [t for t in rows if t["id"] >= fromId]
+        elif startTime is not None:
+            rows = [t for t in rows if t["time"] >= startTime]
+        return [dict(t) for t in rows[:limit]]
+
+    def futures_income_history(self, startTime=None, limit=100, incomeType=None):
+        self.call("futures_income_history")
+        rows = [r for r in self.income
+                if (startTime is None or r["time"] >= startTime)
+                and incomeType in (None, r["incomeType"])]
+        return [dict(r) for r in rows[:limit]]
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("binance")
+
+import account
+import recorder
+
+from fake_exchange import FakeExchange
+
+
+@pytest.fixture
+def exchange(monkeypatch):
+    fake = FakeExchange()
+    monkeypatch.setattr(recorder, "make_client", lambda api_key, api_secret: fake)
+    return fake
+
+
+def test_forced_refresh_waits_for_sync_started_after_the_request(exchange):
+    snapshot = account.AccountSnapshot("key", "secret")
+    snapshot.sync()
+
+    inFlight = threading.Event()
+    release = threading.Event()
+    positions = exchange.futures_position_information
+
+    def slow_positions(symbol=None):
+        # Answer with the positions as they were when the request was sent
+        result = positions(symbol)
+        if not inFlight.is_set():
+            inFlight.set()
+            release.wait(5)
+        return result
+
+    exchange.futures_position_information = slow_positions
+
+    stale = threading.Thread(target=snapshot.refresh, kwargs={"force": True})
+    stale.start()
+    assert inFlight.wait(5)
+
+    # The entry fills while the first sync is on the wire
+    exchange.positions["BTCUSDT"] = 1.0
+    result = []
+    reader = threading.Thread(
+        target=lambda: result.append(snapshot.get_position_amt("BTCUSDT", refresh=True)))
+    reader.start()
+    time.sleep(0.05)
+    release.set()
+    stale.join(5)
+    reader.join(5)
+
+    assert result == [1.0]
+    assert exchange.calls["futures_account_balance"] == 3
+
+
+def test_back_to_back_forced_refreshes_both_sync(exchange):
+    snapshot = account.AccountSnapshot("key", "secret")
+    snapshot.get_balance(refresh=True)
+    snapshot.get_balance(refresh=True)
+    assert exchange.calls["futures_account_balance"] == 2
+
+
+def test_rest_result_does_not_overwrite_newer_event(exchange):
+    snapshot = account.AccountSnapshot("key", "secret")
+    snapshot.sync()
+
+    positions = exchange.futures_position_information
+
+    def event_during_request(symbol=None):
+        result = positions(symbol)
+        snapshot.handle_event({"e": "ACCOUNT_UPDATE", "a": {
+            "B": [], "P": [{"s": "BTCUSDT", "pa": "2.0", "ps": "BOTH"}]}})
+        return result
+
+    exchange.futures_position_information = event_during_request
+    snapshot.sync()
+    assert snapshot.get_position_amt("BTCUSDT") == 2.0
+
+
+def test_stream_error_falls_back_to_polling(exchange):
+    snapshot = account.AccountSnapshot("key", "secret", poll_age=0.0)
+    snapshot.sync()
+    snapshot.streaming = True
+    snapshot.handle_event({"e": "error", "m": "disconnected"})
+    assert not snapshot.streaming
+    assert snapshot.is_stale()
+
+    snapshot.handle_event({"e": "ORDER_TRADE_UPDATE", "o": {}})
+    assert snapshot.streaming
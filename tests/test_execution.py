@@ -0,0 +1,202 @@
+import time
+
+import pytest
+
+pytest.importorskip("binance")
+
+import account
+import execution
+import ledger
+import recorder
+import util
+
+from fake_exchange import FakeExchange, VirtualClock
+from order import OrderMgr
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = VirtualClock()
+    monkeypatch.setattr(time, "time", clock.time)
+    monkeypatch.setattr(time, "sleep", clock.sleep)
+    return clock
+
+
+@pytest.fixture
+def exchange(monkeypatch):
+    fake = FakeExchange()
+    monkeypatch.setattr(recorder, "make_client", lambda api_key, api_secret: fake)
+    monkeypatch.setattr(recorder, "start_user_socket",
+                        lambda api_key, api_secret, callback: fake.subscribe(callback))
+    monkeypatch.setattr(account, "_snapshots", {})
+    monkeypatch.setattr(ledger, "_ledgers", {})
+    monkeypatch.setattr(ledger, "LEDGER_DB", ":memory:")
+    monkeypatch.setattr(util, "sendTelegram", lambda message, *args, **kwargs: None)
+    return fake
+
+
+@pytest.fixture
+def snapshot(exchange, clock):
+    return account.get_snapshot("key", "secret")
+
+
+def executor(exchange, snapshot=None):
+    return execution.EntryExecutor(exchange, 2, 3, account=snapshot)
+
+
+def last_order(exchange):
+    return max(exchange.orders)
+
+
+def test_limit_fill_is_seen_from_the_stream(exchange, clock, snapshot):
+    clock.after(3.0, lambda: exchange.fill(last_order(exchange), 1.0, 99.5))
+    result = executor(exchange, snapshot).execute("BTCUSDT", "BUY", 1.0, 99.5, mode="limit")
+
+    assert result["status"] == "FILLED"
+    assert result["executedQty"] == 1.0
+    assert result["latency"] < 3.5
+    # One REST fallback check at most, instead of polling every interval
+    assert exchange.calls["futures_get_order"] <= 1
+    assert snapshot.listeners == []
+
+
+def test_limit_falls_back_to_rest_when_events_are_missed(exchange, clock, snapshot):
+    exchange.drop_events = True
+    clock.after(3.0, lambda: exchange.fill(last_order(exchange), 1.0, 99.5))
+    result = executor(exchange, snapshot).execute("BTCUSDT", "BUY", 1.0, 99.5, mode="limit")
+
+    assert result["executedQty"] == 1.0
+    assert result["latency"] < 3.0 + execution.EntryExecutor.FALLBACK_POLL + 0.5
+
+
+def test_limit_polls_over_rest_without_stream(exchange, clock):
+    result = executor(exchange).execute("BTCUSDT", "BUY", 1.0, 99.5, mode="limit")
+
+    assert result["status"] == "CANCELED"
+    assert result["unresolved"] == []
+    timeout = execution.EntryExecutor.TIMEOUTS["limit"]
+    assert exchange.calls["futures_get_order"] <= timeout / execution.EntryExecutor.POLL + 2
+
+
+def test_limit_market_sends_rest_at_market_within_bound(exchange, clock, snapshot):
+    exchange.limit_fill = 0.5
+    result = executor(exchange, snapshot).execute(
+        "BTCUSDT", "BUY", 1.0, 100.0, mode="limit_market")
+
+    assert result["status"] == "FILLED"
+    assert len(result["orderIds"]) == 2
+    assert exchange.orders[last_order(exchange)]["type"] == "MARKET"
+
+
+def test_limit_market_skips_market_when_book_moved(exchange, clock, snapshot):
+    exchange.limit_fill = 0.5
+    exchange.ask = 101.0
+    result = executor(exchange, snapshot).execute(
+        "BTCUSDT", "BUY", 1.0, 100.0, mode="limit_market")
+
+    assert result["status"] == "PARTIALLY_FILLED"
+    assert result["executedQty"] == 0.5
+    assert all(o["type"] == "LIMIT" for o in exchange.orders.values())
+
+
+def test_chase_reprices_after_post_only_expires(exchange, clock, snapshot):
+    place = exchange.futures_create_order
+
+    def place_and_move(**params):
+        # The book drops under the first quote before it arrives
+        if exchange.calls["futures_create_order"] == 0:
+            exchange.bid, exchange.ask = 99.5, 99.51
+        return place(**params)
+
+    exchange.futures_create_order = place_and_move
+    clock.after(5.0, lambda: exchange.fill(last_order(exchange), 1.0, 99.5))
+    result = executor(exchange, snapshot).execute("BTCUSDT", "BUY", 1.0, 100.0, mode="chase")
+
+    assert result["executedQty"] == 1.0
+    assert exchange.orders[1]["status"] == "EXPIRED"
+    assert exchange.orders[2]["price"] == "99.50"
+    # The book is read at most once per REPRICE interval
+    assert exchange.calls["futures_orderbook_ticker"] <= 5.0 / execution.EntryExecutor.REPRICE + 2
+
+
+def test_sliced_small_quantity_sends_one_order(exchange, clock, snapshot):
+    exchange.limit_fill = 1.0
+    result = executor(exchange, snapshot).execute(
+        "BTCUSDT", "BUY", 0.5, 100.0, mode="sliced", slices=3)
+
+    assert result["executedQty"] == 0.5
+    assert len(exchange.orders) == 1
+
+
+def test_sliced_caps_slices_at_quantity_step(exchange, clock, snapshot):
+    exchange.limit_fill = 1.0
+    result = executor(exchange, snapshot).execute(
+        "BTCUSDT", "BUY", 0.002, 1000000.0, mode="sliced", slices=5)
+
+    assert result["executedQty"] == 0.002
+    assert [float(o["origQty"]) for o in exchange.orders.values()] == [0.001, 0.001]
+
+
+# send_order reconciliation of the executor result with the position
+
+ALERT = {"symbol": "BTCUSDT", "side": "BUY", "price": "100", "take_profit": "110",
+         "stop_loss": "95", "percentage": "1", "strategy": "trend", "interval": "1h"}
+
+
+@pytest.fixture
+def brackets(monkeypatch):
+    calls = []
+    monkeypatch.setattr(OrderMgr, "send_long_orders",
+                        lambda self, order, *args: calls.append((order, args[-1])))
+    return calls
+
+
+def entry(monkeypatch, executedQty, unresolved=()):
+    def execute(self, symbol, side, quantity, price, mode=None, timeout=None, slices=None):
+        return {"symbol": symbol, "side": side, "status": "FILLED", "executedQty": executedQty,
+                "avgPrice": 100.0 if executedQty else 0.0, "orderIds": [1],
+                "unresolved": list(unresolved),
+                "mode": mode, "latency": 0.0, "slippage_bps": None}
+    monkeypatch.setattr(execution.EntryExecutor, "execute", execute)
+
+
+def test_send_order_uses_streamed_position_without_rest(exchange, clock, brackets):
+    mgr = OrderMgr("key", "secret")
+    positions = exchange.calls["futures_position_information"]
+    exchange.limit_fill = 1.0
+    mgr.send_order(ALERT, "key", "secret")
+
+    assert brackets[0][1] == 2.0
+    assert exchange.calls["futures_position_information"] == positions
+    assert exchange.calls["futures_exchange_info"] == 1
+
+
+def test_send_order_rereads_position_once_for_unresolved_entry(exchange, clock, brackets, monkeypatch):
+    mgr = OrderMgr("key", "secret")
+    positions = exchange.calls["futures_position_information"]
+    exchange.positions["BTCUSDT"] = 2.0
+    entry(monkeypatch, 0.0, unresolved=[1])
+    assert mgr.send_order(ALERT, "key", "secret")
+
+    # The executor could not confirm the entry, the exchange has a position:
+    # protect it
+    order, positionAmt = brackets[0]
+    assert positionAmt == 2.0
+    assert order["executedQty"] == 2.0
+    assert order["avgPrice"] == 100.0
+    assert exchange.calls["futures_position_information"] == positions + 1
+
+
+def test_send_order_never_protects_less_than_confirmed(exchange, clock, brackets, monkeypatch):
+    mgr = OrderMgr("key", "secret")
+    entry(monkeypatch, 2.0)
+    assert mgr.send_order(ALERT, "key", "secret")
+    assert brackets[0][1] == 2.0
+
+
+def test_send_order_without_fill_or_position_aborts(exchange, clock, brackets, monkeypatch):
+    mgr = OrderMgr("key", "secret")
+    entry(monkeypatch, 0.0)
+    assert not mgr.send_order(ALERT, "key", "secret")
+    assert brackets == []
+    assert mgr.ledger.summary()["trades"] == 0
@@ -0,0 +1,103 @@
+import pytest
+
+pytest.importorskip("binance")
+
+import ledger
+import recorder
+
+from fake_exchange import FakeExchange
+
+
+@pytest.fixture
+def exchange(monkeypatch):
+    fake = FakeExchange()
+    monkeypatch.setattr(recorder, "make_client", lambda api_key, api_secret: fake)
+    return fake
+
+
+@pytest.fixture
+def book(exchange):
+    return ledger.TradeLedger("key", "secret", ":memory:")
+
+
+def add_fill(exchange, orderId, t, pnl=0.0, commission=0.1, symbol="BTCUSDT"):
+    exchange.trades.append({
+        "symbol": symbol, "id": len(exchange.trades) + 1, "orderId": orderId,
+        "side": "BUY", "price": "100", "qty": "1", "realizedPnl": str(pnl),
+        "commission": str(commission), "commissionAsset": "USDT", "time": t})
+
+
+def add_income(exchange, tranId, incomeType, income, t, symbol="BTCUSDT"):
+    exchange.income.append({
+        "tranId": tranId, "incomeType": incomeType, "asset": "USDT",
+        "symbol": symbol, "income": str(income), "time": t})
+
+
+def test_fills_are_paged_from_the_cursor(exchange, book, monkeypatch):
+    monkeypatch.setattr(ledger.TradeLedger, "PAGE_LIMIT", 2)
+    book.open_trade("T1", "BTCUSDT", opened_at=1000)
+    book.add_order("T1", "BTCUSDT", 7)
+    for i in range(5):
+        add_fill(exchange, 7, 1000 + i, pnl=1.0)
+
+    assert book.sync("BTCUSDT")
+    assert book.get_cursor("fills:BTCUSDT") == 6
+    assert book.get_trade("T1")["realized_pnl"] == 5.0
+
+    # Nothing new: one empty page from the cursor, totals unchanged
+    calls = exchange.calls["futures_account_trades"]
+    book.sync("BTCUSDT")
+    assert exchange.calls["futures_account_trades"] == calls + 1
+    assert book.get_trade("T1")["realized_pnl"] == 5.0
+
+
+def test_fill_synced_before_its_order_is_attributed_late(exchange, book):
+    book.open_trade("T1", "BTCUSDT", opened_at=1000)
+    book.open_trade("T2", "BTCUSDT", opened_at=1000)
+    add_fill(exchange, 9, 1500, pnl=2.0, commission=0.5)
+    book.sync("BTCUSDT")
+    # Two trades open at that time, so the fill stays unattributed
+    assert book.get_trade("T1")["realized_pnl"] == 0.0
+
+    book.add_order("T2", "BTCUSDT", {"orderId": 9})
+    trade = book.get_trade("T2")
+    assert trade["realized_pnl"] == 2.0
+    assert trade["fees"] == 0.5
+    assert book.get_order_pnl("BTCUSDT", 9) == (2.0, 0.5, 1.0)
+
+
+def test_unregistered_fill_goes_to_the_open_trade(exchange, book):
+    book.open_trade("T1", "BTCUSDT", opened_at=1000)
+    book.close_trade("T1", closed_at=2000)
+    book.open_trade("T2", "BTCUSDT", opened_at=3000)
+    add_fill(exchange, 11, 1500, pnl=-1.0)
+    add_fill(exchange, 12, 3500, pnl=3.0)
+    book.sync("BTCUSDT")
+    assert book.get_trade("T1")["realized_pnl"] == -1.0
+    assert book.get_trade("T2")["realized_pnl"] == 3.0
+
+
+def test_funding_is_attributed_by_time(exchange, book):
+    book.open_trade("T1", "BTCUSDT", opened_at=1000)
+    add_income(exchange, 1, "FUNDING_FEE", -0.25, 1200)
+    add_income(exchange, 2, "FUNDING_FEE", -0.25, 1300)
+    add_income(exchange, 3, "REALIZED_PNL", 5.0, 1300)
+    book.sync("BTCUSDT")
+    book.sync("BTCUSDT")
+
+    assert book.get_trade("T1")["funding"] == -0.5
+    assert book.get_cursor("income") == 1300
+
+
+def test_summary_counts_closed_trades_only(exchange, book):
+    book.open_trade("T1", "BTCUSDT", opened_at=1000)
+    book.add_order("T1", "BTCUSDT", 1)
+    add_fill(exchange, 1, 1100, pnl=4.0, commission=1.0)
+    book.open_trade("T2", "BTCUSDT", opened_at=1200)
+    book.sync("BTCUSDT")
+    book.close_trade("T1", closed_at=1300)
+
+    summary = book.summary()
+    assert summary["trades"] == 1
+    assert summary["net"] == 3.0
+    assert book.summary(since=1400)["trades"] == 0
@@ -0,0 +1,103 @@
+import time
+
+import pytest
+
+binance = pytest.importorskip("binance")
+
+import account
+import ledger
+import recorder
+import replay
+import util
+
+from fake_exchange import FakeExchange, VirtualClock
+from order import OrderMgr
+
+ALERT = {"symbol": "BTCUSDT", "side": "BUY", "price": "100", "take_profit": "110",
+         "stop_loss": "95", "percentage": "1", "strategy": "trend", "interval": "1h"}
+
+
+@pytest.fixture
+def exchange(monkeypatch):
+    fake = FakeExchange()
+
+    class SocketManager:
+
+        def __init__(self, api_key=None, api_secret=None):
+            pass
+
+        def start(self):
+            pass
+
+        def start_futures_user_socket(self, callback):
+            fake.subscribe(callback)
+
+        def stop(self):
+            pass
+
+    monkeypatch.setattr(recorder, "Client", lambda api_key, api_secret: fake)
+    monkeypatch.setattr(binance, "ThreadedWebsocketManager", SocketManager, raising=False)
+    monkeypatch.setattr(account, "_snapshots", {})
+    monkeypatch.setattr(ledger, "_ledgers", {})
+    monkeypatch.setattr(ledger, "LEDGER_DB", ":memory:")
+    monkeypatch.setattr(util, "sendTelegram", lambda message, *args, **kwargs: None)
+    return fake
+
+
+def record_session(exchange, monkeypatch, path):
+    clock = VirtualClock()
+    realTime, realSleep = time.time, time.sleep
+    monkeypatch.setattr(time, "time", clock.time)
+    monkeypatch.setattr(time, "sleep", clock.sleep)
+
+    def stop_loss_hit():
+        stopLoss = [o for o in exchange.orders.values() if o["type"] == "STOP_MARKET"]
+        exchange.fill(stopLoss[0]["orderId"], exchange.positions["BTCUSDT"], 95.0)
+
+    exchange.limit_fill = 1.0
+    clock.after(20.0, stop_loss_hit)
+
+    recorder.start(path)
+    try:
+        recorder.record_alert(dict(ALERT, key="secret"))
+        OrderMgr("key", "secret").send_order(ALERT, "key", "secret")
+    finally:
+        recorder.stop()
+        monkeypatch.setattr(time, "time", realTime)
+        monkeypatch.setattr(time, "sleep", realSleep)
+
+
+@pytest.mark.parametrize("name", ["session.jsonl", "session.jsonl.gz"])
+def test_replay_on_recording_version_matches_every_call(exchange, monkeypatch, tmp_path, name):
+    path = str(tmp_path / name)
+    record_session(exchange, monkeypatch, path)
+
+    report = replay.Replayer(path).run()
+
+    assert report["alerts"] == 1
+    assert report["telegrams"] > 0
+    assert report["unmatched_by_method"] == {}
+    assert report["unused_by_method"] == {}
+    assert report["calls_by_method"] == report["recorded_by_method"]
+    assert report["recorded_calls"] == sum(exchange.calls.values())
+
+
+def test_truncated_log_reads_up_to_last_record(tmp_path):
+    path = str(tmp_path / "session.jsonl.gz")
+    log = recorder.Recorder(path)
+    log.write("alert", r={"symbol": "BTCUSDT"})
+    log.write_call("futures_get_order", [], {"symbol": "BTCUSDT", "orderId": 1}, 0.1,
+                   result={"status": "NEW"})
+    # Crash: the gzip stream is flushed but never closed
+    log.file.flush()
+    with open(path, "rb") as f:
+        data = f.read()
+
+    copy = str(tmp_path / "copy.jsonl.gz")
+    with open(copy, "wb") as f:
+        f.write(data)
+    log.close()
+
+    replayer = replay.Replayer(copy)
+    assert len(replayer.alerts) == 1
+    assert replayer.recorded["futures_get_order"] == 1
@@ -6,6 +6,7 @@ from auth import get_token
 from flask import Flask, request, abort
 
 from order import OrderMgr
+import recorder
 import util
 
 # Create Flask object called app.
@@ -27,6 +28,7 @@ def webhook():
             log = util.getLogger("webhook")
             log.info(" [ALERT RECEIVED] ")
             log.debug(pprint.pformat(data))
+            recorder.record_alert(data)
 
             api_key = os.environ.get("binance_api")
             api_secret = os.environ.get("binance_secret")
@@ -98,6 +100,8 @@ if __name__ == "__main__":
     config = util.getConfig("config.txt")
     if config:
         port = config.get("webhook", "port")
+        if config.has_option("recorder", "path"):
+            recorder.start(config.get("recorder", "path"))
         app.run(host="localhost", port=port)
     else:
         sys.exit("Invalid config file: config.txt")